@@ -6,14 +6,29 @@ from typing import Protocol, runtime_checkable, cast
 import yaml
 
 
+def get_file_path(file_name: str):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+
+
+def get_file_mtime(file_name: str):
+    try:
+        return os.stat(get_file_path(file_name)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_yaml(file_name: str):
+    with open(get_file_path(file_name), 'r') as file:
+        return yaml.safe_load(file)
+
+
 def load_yaml_or_exit(file_name: str):
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    path = get_file_path(file_name)
 
     if not os.path.isfile(path):
         exit(f"{path} not found")
 
-    with open(path, 'r') as file:
-        return yaml.safe_load(file)
+    return load_yaml(file_name)
 
 
 @runtime_checkable
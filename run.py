@@ -2,7 +2,7 @@ import argparse
 import socket
 import ssl
 import time
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from typing import cast
 from urllib.parse import urlparse
@@ -12,11 +12,15 @@ from croniter import croniter, CroniterBadCronError, CroniterBadDateError
 
 import telegram_helper
 from console_helper import Color, color_text
-from filesystem_helper import save_cache, load_yaml_or_exit, load_cache, get_cache_path
+from filesystem_helper import save_cache, load_yaml_or_exit, load_cache, get_cache_path, load_yaml, get_file_mtime
 
 CONFIG_FILE_NAME = 'config.yaml'
 MESSAGES_FILE_NAME = 'messages.yaml'
 REQUIRED_FIELDS = ['url', 'tg_chats_to_notify']
+REQUIRED_MESSAGES = {
+    'error': {'site_name': '', 'error': '', 'server_info': '', 'count': 1, 'curl': ''},
+    'back_online': {'site_name': '', 'failed_attempts': 1, 'minutes': 1, 'server_info': ''},
+}
 DEFAULT = {
     'timeout': 5,
     'schedule': '* * * * *',
@@ -29,6 +33,10 @@ DEFAULT = {
     'follow_redirects': False,
     'notify_after_attempt': 1,
 }
+CERTIFICATE_CACHE_TTL = 3600
+# A change to any of these fields makes the cached failure state refer to a different check
+STATE_FIELDS = ['url', 'method', 'post_data', 'headers', 'status_code', 'search_string', 'absent_string',
+                'follow_redirects', 'tg_chats_to_notify']
 
 
 class RequestMethod(Enum):
@@ -40,20 +48,38 @@ class RequestMethod(Enum):
 certificate_cache = {}
 
 
-def get_certificate_expiry_with_cache(hostname: str, port: int = 443) -> dict:
-    cache_key = '{}:{}'.format(hostname, port)
+def get_certificate_cache_key(url: str) -> str | None:
+    if not url.startswith('https://'):
+        return None
+
+    parsed_url = urlparse(url)
+
+    return '{}:{}'.format(parsed_url.hostname, parsed_url.port if parsed_url.port else 443)
+
+
+def get_certificate_expiry_with_cache(url: str, timeout: int) -> dict:
+    cache_key = get_certificate_cache_key(url)
+
+    cached = certificate_cache.get(cache_key)
+
+    if cached is None or time.time() - cached['fetched_at'] >= CERTIFICATE_CACHE_TTL:
+        parsed_url = urlparse(url)
+        cert = get_certificate_expiry(parsed_url.hostname, parsed_url.port if parsed_url.port else 443, timeout)
+
+        # Errors are not cached, so a transient connection failure is retried on the next check
+        if cert['error']:
+            return cert
 
-    if cache_key not in certificate_cache:
-        certificate_cache[cache_key] = get_certificate_expiry(hostname, port)
+        cached = certificate_cache[cache_key] = {**cert, 'fetched_at': int(time.time())}
 
-    return certificate_cache[cache_key]
+    return {**cached, 'is_valid': cached['not_before'] <= datetime.now(tz=timezone.utc) <= cached['not_after']}
 
 
-def get_certificate_expiry(hostname: str, port: int = 443) -> dict:
+def get_certificate_expiry(hostname: str, port: int = 443, timeout: int = DEFAULT['timeout']) -> dict:
     try:
         context = ssl.create_default_context()
 
-        with socket.create_connection((hostname, port)) as sock:
+        with socket.create_connection((hostname, port), timeout=timeout) as sock:
             with context.wrap_socket(sock, server_hostname=hostname) as ssock:
                 cert = ssock.getpeercert()
 
@@ -147,9 +173,7 @@ def perform_request(url: str,
                     post_data: str,
                     headers: dict):
     if url.startswith('https://'):
-        parsed_url = urlparse(url)
-        hostname = parsed_url.hostname
-        cert = get_certificate_expiry_with_cache(hostname, parsed_url.port if parsed_url.port else 443)
+        cert = get_certificate_expiry_with_cache(url, timeout)
 
         if cert['error']:
             return f"SSL certificate error: {cert['error']}"
@@ -209,6 +233,10 @@ def check_writing_to_cache():
 
 
 def check_config(config):
+    print_check_config_report(get_check_config_report(config))
+
+
+def get_check_config_report(config):
     report = {}
 
     for site_name, site in config['sites'].items():
@@ -230,6 +258,8 @@ def check_config(config):
                     report[site_name][Color.ERROR][field_name] = 'chat IDs must contain only digits'
                 else:
                     report[site_name][Color.SUCCESS][field_name] = ', '.join(get_uniq_chat_ids(chat_id_list))
+            elif field_name == 'url' and not isinstance(site[field_name], str):
+                report[site_name][Color.ERROR][field_name] = 'must be a string'
             else:
                 report[site_name][Color.SUCCESS][field_name] = site[field_name]
         for field_name in site:
@@ -272,7 +302,7 @@ def check_config(config):
             else:
                 report[site_name][Color.WARNING][field_name] = f"not found, default value is '{DEFAULT[field_name]}'"
 
-    print_check_config_report(report)
+    return report
 
 
 def print_check_config_report(report):
@@ -285,7 +315,8 @@ def print_check_config_report(report):
 
 def is_valid_cron(schedule: str) -> bool:
     try:
-        croniter(schedule)
+        # Computing the next run also rejects schedules that can never fire, like '0 0 30 2 *'
+        croniter(schedule).get_next(datetime)
 
         return True
     except (CroniterBadCronError, CroniterBadDateError):
@@ -307,6 +338,9 @@ def main():
     parser.add_argument('--check-config',
                         action='store_true',
                         help='Check configuration for each site and display missing or default values')
+    parser.add_argument('--loop',
+                        action='store_true',
+                        help='Keep running and check sites on schedule, reloading the config files when they change')
     args = parser.parse_args()
 
     config = load_yaml_or_exit(CONFIG_FILE_NAME)
@@ -321,6 +355,8 @@ def main():
     elif args.check_config:
         check_config(config)
         check_writing_to_cache()
+    elif args.loop:
+        run_loop(config, messages, force=args.force)
     else:
         cache = load_cache()
         process_each_site(config, cache, force=args.force)
@@ -447,5 +483,177 @@ def process_each_site(config, cache: dict, force=False):
             process_site(site, site_name, cache)
 
 
+def get_config_errors(config, messages) -> list[str]:
+    if not isinstance(config, dict) or not isinstance(config.get('sites'), dict):
+        return [f"{CONFIG_FILE_NAME}: 'sites' must be a dictionary"]
+
+    if not isinstance(messages, dict):
+        return [f"{MESSAGES_FILE_NAME}: must be a dictionary"]
+
+    errors = []
+
+    if not isinstance(config.get('telegram_bot_token'), str) or not config['telegram_bot_token']:
+        errors.append(f"{CONFIG_FILE_NAME}: telegram_bot_token: required field not found, you need to add it")
+
+    for key, placeholders in REQUIRED_MESSAGES.items():
+        if not isinstance(messages.get(key), str):
+            errors.append(f"{MESSAGES_FILE_NAME}: {key}: required message not found")
+            continue
+
+        try:
+            messages[key].format(**placeholders)
+        except (KeyError, IndexError, ValueError) as e:
+            errors.append(f"{MESSAGES_FILE_NAME}: {key}: invalid placeholder: {e}")
+
+    errors += [f"{site_name}: must be a dictionary"
+               for site_name, site in config['sites'].items() if not isinstance(site, dict)]
+
+    if errors:
+        return errors
+
+    try:
+        report = get_check_config_report(config)
+    except (AttributeError, TypeError) as e:
+        return [f"{CONFIG_FILE_NAME}: {e}"]
+
+    for site_name, fields in report.items():
+        for field_name, message in fields[Color.ERROR].items():
+            errors.append(f"{site_name}: {field_name}: {message}")
+
+    return errors
+
+
+def get_config_mtimes():
+    return get_file_mtime(CONFIG_FILE_NAME), get_file_mtime(MESSAGES_FILE_NAME)
+
+
+def reload_config():
+    try:
+        config = load_yaml(CONFIG_FILE_NAME)
+        messages = load_yaml(MESSAGES_FILE_NAME)
+    except Exception as e:
+        color_text(f"Config reload rejected, keeping the previous config:\n{e}", Color.ERROR)
+
+        return None
+
+    errors = get_config_errors(config, messages)
+
+    if errors:
+        color_text("Config reload rejected, keeping the previous config:", Color.ERROR)
+
+        for error in errors:
+            color_text(f"  {error}", Color.ERROR)
+
+        return None
+
+    return config, messages
+
+
+def diff_sites(old_sites: dict, new_sites: dict):
+    added = new_sites.keys() - old_sites.keys()
+    removed = old_sites.keys() - new_sites.keys()
+    changed = {site_name for site_name in old_sites.keys() & new_sites.keys()
+               if old_sites[site_name] != new_sites[site_name]}
+
+    return added, removed, changed
+
+
+def get_next_run(site, after: datetime) -> datetime:
+    return croniter(site.get('schedule', DEFAULT['schedule']), after).get_next(datetime)
+
+
+def plan_site(site, now: datetime) -> datetime:
+    # Planning from just before the current minute lets a site run in it if the schedule matches
+    return get_next_run(site, now - timedelta(seconds=1))
+
+
+def replan(old_config, new_config, schedule: dict, cache: dict, now: datetime):
+    added, removed, changed = diff_sites(old_config['sites'], new_config['sites'])
+
+    for site_name in removed:
+        schedule.pop(site_name, None)
+        cache.pop(site_name, None)
+
+    for site_name in changed:
+        old_site, new_site = old_config['sites'][site_name], new_config['sites'][site_name]
+        cache_info = cache.get(site_name)
+
+        if cache_info is None or not any(old_site.get(field_name, DEFAULT.get(field_name)) !=
+                                         new_site.get(field_name, DEFAULT.get(field_name))
+                                         for field_name in STATE_FIELDS):
+            continue
+
+        # A site already reported as down keeps its state, so the chats still get the back online message
+        if not cache_info.get('notified_down') or cache_info.get('notified_restore'):
+            del cache[site_name]
+
+    for site_name in added | changed:
+        schedule[site_name] = plan_site(new_config['sites'][site_name], now)
+
+    used_certificates = {get_certificate_cache_key(site['url']) for site in new_config['sites'].values()}
+
+    return added, removed, changed, certificate_cache.keys() - used_certificates
+
+
+def run_loop(config, messages, force=False):
+    errors = get_config_errors(config, messages)
+
+    if errors:
+        exit('\n'.join(errors))
+
+    mtimes = get_config_mtimes()
+    cache = load_cache()
+    now = datetime.now().replace(second=0, microsecond=0)
+    schedule = {site_name: now if force else plan_site(site, now) for site_name, site in config['sites'].items()}
+
+    while True:
+        now = datetime.now().replace(second=0, microsecond=0)
+
+        current_mtimes = get_config_mtimes()
+
+        if current_mtimes != mtimes:
+            mtimes = current_mtimes
+            reloaded = reload_config()
+
+            if reloaded:
+                # Re-plan on copies, so a failure leaves the previous config and schedule untouched
+                new_schedule, new_cache = dict(schedule), dict(cache)
+
+                try:
+                    added, removed, changed, unused_certificates = replan(config, reloaded[0], new_schedule,
+                                                                          new_cache, now)
+                except Exception as e:
+                    color_text(f"Config reload failed, keeping the previous config:\n{e}", Color.ERROR)
+                else:
+                    config, messages = reloaded
+                    schedule, cache = new_schedule, new_cache
+
+                    for cache_key in unused_certificates:
+                        certificate_cache.pop(cache_key, None)
+
+                    color_text(f"Config reloaded: {len(added)} added, {len(removed)} removed, {len(changed)} changed",
+                               Color.SUCCESS)
+
+        for site_name, next_run in schedule.items():
+            if next_run <= now:
+                site = config['sites'][site_name]
+                schedule[site_name] = get_next_run(site, now)
+
+                try:
+                    process_site(site, site_name, cache)
+                except Exception as e:
+                    color_text(f"Error checking {site_name}: {e}", Color.ERROR)
+
+        # Telegram or cache write failures must not end the loop, the next tick retries them
+        try:
+            save_cache(cache)
+            process_cache(cache, config, messages)
+            save_cache(cache)
+        except Exception as e:
+            color_text(f"Error processing the cache: {e}", Color.ERROR)
+
+        time.sleep(60 - time.time() % 60)
+
+
 if __name__ == "__main__":
     main()